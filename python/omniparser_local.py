@@ -6,18 +6,99 @@ Local OmniParser implementation using YOLOv8 and Florence-2
 import os
 import json
 import base64
+import hashlib
+import shutil
+import contextlib
+import threading
+import itertools
+import queue
+import time
+import uuid
+from collections import OrderedDict
 from pathlib import Path
 from typing import List, Dict, Any, Tuple
+
+# Must be set before torch/cv2 are imported:
+# let the CUDA caching allocator grow segments instead of fragmenting
+os.environ.setdefault('PYTORCH_CUDA_ALLOC_CONF', 'expandable_segments:True')
+# models are loaded from local snapshots, never fetched from the Hub at serving time
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 import torch
+import torch.nn.functional as F
 from ultralytics import YOLO
+from ultralytics.engine.results import Results
+from ultralytics.utils import ops
+try:
+    # Newer ultralytics releases moved NMS out of ultralytics.utils.ops
+    from ultralytics.utils.nms import non_max_suppression
+except ImportError:
+    non_max_suppression = ops.non_max_suppression
 from transformers import AutoProcessor, AutoModelForCausalLM
 import cv2
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import supervision as sv
 
+# Input shapes are fixed (letterboxed YOLO input, processor-sized crops), so let cuDNN
+# autotune conv algorithms once and reuse them across requests
+torch.backends.cudnn.benchmark = True
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """Fall back to plain Python when numba is not installed"""
+        return lambda func: func
+
+def hex_to_bgr(color: str) -> Tuple[int, int, int]:
+    """Convert '#RRGGBB' to an OpenCV BGR tuple"""
+    r, g, b = (int(color[i:i + 2], 16) for i in (1, 3, 5))
+    return (b, g, r)
+
+# Visualization colors per element type, as BGR for OpenCV drawing
+VISUALIZATION_COLORS = {
+    'icon': hex_to_bgr('#FF6B6B'),
+    'button': hex_to_bgr('#4ECDC4'),
+    'text': hex_to_bgr('#45B7D1'),
+    'unknown': hex_to_bgr('#95A5A6')
+}
+
+# Element type codes returned by classify_contour_boxes
+CONTOUR_TYPES = ('icon', 'button', 'text')
+
+@njit(cache=True)
+def classify_contour_boxes(boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Filter and classify (x, y, w, h) contour boxes with integer-only heuristics"""
+    count = boxes.shape[0]
+    keep = np.zeros(count, dtype=np.bool_)
+    types = np.zeros(count, dtype=np.int32)
+    areas = np.zeros(count, dtype=np.int64)
+    
+    for i in range(count):
+        w = np.int64(boxes[i, 2])
+        h = np.int64(boxes[i, 3])
+        area = w * h
+        
+        # Filter small contours; icon if small, button if wide (w / h > 2.5), else text
+        keep[i] = (w >= 20) & (h >= 20)
+        types[i] = (area >= 2500) * (1 + (2 * w <= 5 * h))
+        areas[i] = area
+    
+    return keep, types, areas
+
+class VisionFeatures(torch.nn.Module):
+    """Expose Florence-2's unpooled vision features as a plain forward for export"""
+    
+    def __init__(self, vision_tower: torch.nn.Module):
+        super().__init__()
+        self.vision_tower = vision_tower
+    
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.vision_tower.forward_features_unpool(pixel_values)
+
 class LocalOmniParser:
     def __init__(self, model_config_path: str = "models/model_config.json"):
         """Initialize OmniParser with local models"""
@@ -30,191 +111,744 @@ class LocalOmniParser:
         self.device = self.config['device']
         print(f"Using device: {self.device}")
         
+        # Reduced precision (fp16, or int8 for the YOLO TensorRT engine) only applies on GPU
+        self.precision = 'fp32'
+        if self.device == 'cuda':
+            self.precision = self.config['configs'].get('precision', 'fp16')
+            if self.precision not in ('fp16', 'int8'):
+                print(f"⚠️  Unsupported precision '{self.precision}' on GPU (use fp16 or int8), using fp16")
+                self.precision = 'fp16'
+        print(f"Using precision: {self.precision}")
+        
         # Initialize YOLO for detection
         self.init_yolo()
         
         # Initialize Florence-2 for captioning
         self.init_florence()
         
+        # Reserve a dedicated CUDA memory pool for per-request tensors
+        self.init_memory_pool()
+        
+        # Content-addressed LRU cache of results for repeated screenshots
+        self.result_cache = OrderedDict()
+        self.result_cache_size = self.config['configs'].get('result_cache_size', 256)
+        self.result_cache_lock = threading.Lock()
+        
         print("✅ LocalOmniParser initialized successfully")
     
     def init_yolo(self):
         """Initialize YOLO model for icon detection"""
         try:
             model_path = self.config['yolo_model']
-            if os.path.exists(model_path):
-                self.yolo = YOLO(model_path)
-            else:
+            if not os.path.exists(model_path):
                 print("Using default YOLOv8 model")
-                self.yolo = YOLO('yolov8m.pt')
+                model_path = 'yolov8m.pt'
+            self.yolo = YOLO(model_path)
+            self.yolo.model.eval()
+            self.yolo_backend = 'pytorch'
             
             # Set to appropriate device
             if self.device == 'cuda':
                 self.yolo.to('cuda')
+                self.yolo.model.half()
             
-            print("✅ YOLO model loaded")
+            # Swap eager PyTorch for an exported TensorRT engine / ONNX graph
+            if self.config['configs'].get('export_yolo', True):
+                self.export_yolo(model_path)
+            
+            # Replay the fixed-shape PyTorch forward from a CUDA graph
+            self.init_yolo_graph()
+            
+            print(f"✅ YOLO model loaded ({self.yolo_backend})")
         except Exception as e:
             print(f"Error loading YOLO: {e}")
             self.yolo = None
     
+    def yolo_cache_key(self) -> str:
+        """Build a cache key for exported artifacts (GPU + driver + CUDA runtime + TensorRT)"""
+        if self.device != 'cuda':
+            return 'cpu'
+        
+        try:
+            import tensorrt
+            trt_version = tensorrt.__version__
+        except ImportError:
+            trt_version = 'none'
+        
+        # torch.version.cuda is the runtime; the driver version comes from NVML
+        try:
+            import pynvml
+            pynvml.nvmlInit()
+            driver_version = pynvml.nvmlSystemGetDriverVersion()
+            if isinstance(driver_version, bytes):
+                driver_version = driver_version.decode()
+        except Exception:
+            driver_version = 'unknown'
+        
+        gpu = torch.cuda.get_device_name(0).replace(' ', '_')
+        return f"{gpu}_drv{driver_version}_cuda{torch.version.cuda}_trt{trt_version}"
+    
+    def weights_fingerprint(self, model_path: str) -> str:
+        """Identify a weights file by size and mtime so replaced weights invalidate exports"""
+        stat = os.stat(model_path)
+        return hashlib.blake2b(f"{stat.st_size}:{stat.st_mtime_ns}".encode(), digest_size=6).hexdigest()
+    
+    def florence_fingerprint(self, model_path: str) -> str:
+        """Identify a Florence-2 snapshot by its weight and config files"""
+        files = sorted(
+            path for pattern in ('*.safetensors', '*.bin', 'config.json')
+            for path in Path(model_path).glob(pattern)
+        )
+        stats = [f"{path.name}:{self.weights_fingerprint(str(path))}" for path in files]
+        return hashlib.blake2b(",".join(stats).encode(), digest_size=6).hexdigest()
+    
+    def export_yolo(self, model_path: str):
+        """Export YOLO to TensorRT (GPU) or ONNX (CPU) and reload it from the on-disk cache"""
+        if self.device == 'cuda':
+            export_format, suffix = 'engine', '.engine'
+        else:
+            export_format, suffix = 'onnx', '.onnx'
+        
+        # INT8 engines need a calibration set of sample screenshots (ultralytics dataset yaml)
+        calibration_data = self.config['configs'].get('int8_calibration_data')
+        int8 = export_format == 'engine' and self.precision == 'int8'
+        if int8 and not calibration_data:
+            print("⚠️  precision is int8 but int8_calibration_data is not set, exporting fp16")
+            int8 = False
+        precision = 'int8' if int8 else self.precision
+        
+        try:
+            cache_dir = Path(self.config['configs'].get('cache_dir', 'cache')) / 'yolo'
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            max_batch = self.config['configs'].get('queue_batch_size', 8)
+            input_size = self.config['configs']['input_size']
+            
+            # Fingerprint the file ultralytics actually loaded (e.g. yolov8m.pt from its weights_dir)
+            weights_path = getattr(self.yolo, 'ckpt_path', None) or model_path
+            cached_path = cache_dir / (
+                f"{Path(weights_path).stem}_{self.weights_fingerprint(weights_path)}_{self.yolo_cache_key()}"
+                f"_{precision}_{input_size}_b{max_batch}{suffix}"
+            )
+            
+            if not cached_path.exists():
+                print(f"Exporting YOLO to {export_format} ({precision}), this can take a minute...")
+                export_args = {}
+                if int8:
+                    # TensorRT entropy calibration; the calibration cache is written next to the engine
+                    export_args = {'int8': True, 'data': calibration_data}
+                exported = self.yolo.export(
+                    format=export_format,
+                    half=precision == 'fp16',
+                    imgsz=input_size,
+                    dynamic=True,
+                    batch=max_batch,
+                    device=0 if self.device == 'cuda' else 'cpu',
+                    **export_args
+                )
+                # shutil.move also works when the weights and cache dirs are on different filesystems
+                shutil.move(exported, cached_path)
+            
+            # Ultralytics runs .engine via TensorRT and .onnx via onnxruntime
+            self.yolo = YOLO(str(cached_path), task='detect')
+            self.yolo_backend = export_format
+        except Exception as e:
+            print(f"⚠️  YOLO {export_format} export failed, using PyTorch weights: {e}")
+    
+    def init_yolo_graph(self):
+        """Capture the fixed-shape YOLO forward into a CUDA graph"""
+        self.yolo_graph = None
+        if self.device != 'cuda' or self.yolo_backend != 'pytorch':
+            return
+        if not self.config['configs'].get('cuda_graph', True):
+            return
+        
+        try:
+            model = self.yolo.model.fuse().eval()
+            dtype = next(model.parameters()).dtype
+            input_size = self.config['configs']['input_size']
+            
+            # Persistent input buffer; each request is letterboxed into it in place
+            self.yolo_in = torch.zeros(1, 3, input_size, input_size, dtype=dtype, device='cuda')
+            
+            # Warm up on a side stream so cuDNN autotuning and lazy allocations happen before capture
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream), torch.no_grad():
+                for _ in range(3):
+                    model(self.yolo_in)
+            torch.cuda.current_stream().wait_stream(stream)
+            
+            self.yolo_graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(self.yolo_graph), torch.no_grad():
+                output = model(self.yolo_in)
+                # Detect head returns (predictions, raw feature maps) in eval mode
+                self.yolo_out = output[0] if isinstance(output, (list, tuple)) else output
+            
+            # The graph's input/output buffers are shared, so replays must not interleave
+            self.yolo_lock = threading.Lock()
+            self.init_staging_buffers(input_size)
+            
+            # Exercise postprocessing once so an incompatible NMS/Results API disables the
+            # graph path here instead of failing every request
+            blank = np.zeros((input_size, input_size, 3), dtype=np.uint8)
+            self.yolo_results(blank, self.yolo_out.clone())
+            print("✅ YOLO CUDA graph captured")
+        except Exception as e:
+            print(f"⚠️  YOLO CUDA graph capture failed, using standard inference: {e}")
+            self.yolo_graph = None
+    
+    def init_staging_buffers(self, input_size: int, num_slots: int = 2):
+        """Pinned host + device staging slots so one frame uploads while another replays"""
+        self.h2d_stream = torch.cuda.Stream()
+        self.staging_slots = []
+        for _ in range(num_slots):
+            host = torch.empty(input_size, input_size, 3, dtype=torch.uint8, pin_memory=True)
+            self.staging_slots.append({
+                'host': host,
+                'host_view': host.numpy(),
+                'device': torch.empty(input_size, input_size, 3, dtype=torch.uint8, device='cuda'),
+                'uploaded': torch.cuda.Event(),
+                'consumed': torch.cuda.Event(),
+                'lock': threading.Lock()
+            })
+        self.next_staging_slot = itertools.cycle(self.staging_slots).__next__
+        self.staging_slot_lock = threading.Lock()
+    
+    def yolo_predict_args(self) -> Dict[str, Any]:
+        """Thresholds shared by the ultralytics predictor and the CUDA-graph postprocessing"""
+        configs = self.config['configs']
+        args = {
+            'conf': configs['confidence_threshold'],
+            'iou': configs['iou_threshold'],
+            'max_det': configs.get('max_detections', 300)
+        }
+        # Exported engines/ONNX graphs carry their own precision; only eager fp16 weights need half inputs
+        if self.yolo_backend == 'pytorch' and self.device == 'cuda':
+            args['half'] = True
+        return args
+    
+    def run_yolo(self, image: np.ndarray) -> Results:
+        """Run YOLO on a BGR image, replaying the CUDA graph when captured"""
+        if self.yolo_graph is None:
+            return self.yolo(image, **self.yolo_predict_args())[0]
+        
+        return self.yolo_results(image, self.replay_yolo(image))
+    
+    def replay_yolo(self, image: np.ndarray) -> torch.Tensor:
+        """Stage a BGR image and enqueue a graph replay; returns raw predictions without syncing"""
+        # Letterbox: resize keeping aspect ratio, pad to a centered square
+        height, width = image.shape[:2]
+        input_size = self.yolo_in.shape[-1]
+        scale = min(input_size / height, input_size / width)
+        new_height, new_width = round(height * scale), round(width * scale)
+        top, left = (input_size - new_height) // 2, (input_size - new_width) // 2
+        
+        # Ping-pong between staging slots: this frame's upload overlaps the previous frame's replay
+        with self.staging_slot_lock:
+            slot = self.next_staging_slot()
+        
+        with slot['lock']:
+            # Letterbox straight into pinned memory once the slot's previous upload has drained
+            slot['uploaded'].synchronize()
+            host = slot['host_view']
+            host.fill(114)
+            host[top:top + new_height, left:left + new_width] = cv2.resize(
+                image, (new_width, new_height), interpolation=cv2.INTER_LINEAR
+            )
+            
+            # Async H2D copy on a side stream, after the previous replay stopped reading this slot
+            with torch.cuda.stream(self.h2d_stream):
+                self.h2d_stream.wait_event(slot['consumed'])
+                slot['device'].copy_(slot['host'], non_blocking=True)
+                slot['uploaded'].record(self.h2d_stream)
+            
+            with self.yolo_lock:
+                compute_stream = torch.cuda.current_stream()
+                compute_stream.wait_event(slot['uploaded'])
+                
+                # BGR -> RGB as part of the on-device permute, no extra host-side pass
+                frame = slot['device'].permute(2, 0, 1)[[2, 1, 0]].unsqueeze(0)
+                self.yolo_in.copy_(frame.to(self.yolo_in.dtype) / 255.0)
+                slot['consumed'].record(compute_stream)
+                
+                self.yolo_graph.replay()
+                return self.yolo_out.clone()
+    
+    def yolo_results(self, image: np.ndarray, predictions: torch.Tensor) -> Results:
+        """Apply NMS to raw graph predictions and rescale boxes to the original image"""
+        args = self.yolo_predict_args()
+        detections = non_max_suppression(
+            predictions.float(),
+            args['conf'],
+            args['iou'],
+            max_det=args['max_det']
+        )[0]
+        detections[:, :4] = ops.scale_boxes(self.yolo_in.shape[2:], detections[:, :4], image.shape[:2])
+        
+        return Results(image, path='', names=self.yolo.names, boxes=detections)
+    
+    def run_yolo_batch(self, images: List[np.ndarray]) -> List[Results]:
+        """Run YOLO on several BGR images, as one batched call unless replaying the graph"""
+        if self.yolo_graph is not None:
+            # Enqueue every replay before the first NMS sync so frame k+1 stages while k computes
+            predictions = [self.replay_yolo(image) for image in images]
+            return [self.yolo_results(image, p) for image, p in zip(images, predictions)]
+        
+        return self.yolo(images, **self.yolo_predict_args())
+    
     def init_florence(self):
         """Initialize Florence-2 model for caption generation"""
-        try:
-            model_path = self.config['florence_model']
-            if os.path.exists(model_path):
-                self.processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
-                self.florence_model = AutoModelForCausalLM.from_pretrained(
-                    model_path,
-                    torch_dtype=torch.float16 if self.device == 'cuda' else torch.float32,
-                    trust_remote_code=True
-                ).to(self.device)
+        self.processor = None
+        self.florence_model = None
+        
+        # Prefer the tmpfs copy: its pages are shared by every process that maps it
+        candidates = [self.config.get('florence_shm_path'), self.config['florence_model']]
+        candidates = [path for path in candidates if path and os.path.exists(path)]
+        if not candidates:
+            print("⚠️  Florence-2 model not found, caption generation disabled")
+            return
+        
+        for model_path in candidates:
+            try:
+                self.load_florence(model_path)
                 print("✅ Florence-2 model loaded")
-            else:
-                print("⚠️  Florence-2 model not found, caption generation disabled")
+                return
+            except Exception as e:
+                print(f"Error loading Florence-2 from {model_path}: {e}")
                 self.processor = None
                 self.florence_model = None
-        except Exception as e:
-            print(f"Error loading Florence-2: {e}")
-            self.processor = None
-            self.florence_model = None
     
-    def detect_elements(self, image_path: str) -> Dict[str, Any]:
-        """Detect UI elements in the image"""
-        image = cv2.imread(image_path)
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    def load_florence(self, model_path: str):
+        """Load Florence-2 and its processor from a local snapshot"""
+        print(f"Loading Florence-2 from {model_path}")
+        self.florence_dtype = torch.float16 if self.device == 'cuda' else torch.float32
+        self.processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
         
-        results = {
-            'icons': [],
-            'buttons': [],
-            'text': [],
-            'interactable': [],
-            'all_elements': []
+        # safetensors are memory-mapped instead of read into private memory
+        has_safetensors = any(Path(model_path).glob('*.safetensors'))
+        self.florence_model = AutoModelForCausalLM.from_pretrained(
+            model_path,
+            torch_dtype=self.florence_dtype,
+            low_cpu_mem_usage=True,
+            use_safetensors=has_safetensors or None,
+            trust_remote_code=True
+        ).to(self.device).eval()
+        self.init_caption_inputs()
+        
+        if self.device == 'cuda' and self.config['configs'].get('compile_florence', True):
+            self.compile_florence(model_path)
+    
+    def init_caption_inputs(self):
+        """Precompute the caption prompt and image normalization as device tensors"""
+        image_processor = self.processor.image_processor
+        self.pixel_size = (image_processor.size['height'], image_processor.size['width'])
+        
+        # Tokenize the task prompt once; every crop reuses the same input_ids
+        prompt_inputs = self.processor(
+            text="<CAPTION>",
+            images=Image.new('RGB', self.pixel_size[::-1]),
+            return_tensors="pt"
+        )
+        self.caption_input_ids = prompt_inputs['input_ids'].to(self.device)
+        
+        # Decoding stops as soon as every caption in the batch emits EOS
+        tokenizer = self.processor.tokenizer
+        self.stop_ids = {'pad_token_id': tokenizer.pad_token_id, 'eos_token_id': tokenizer.eos_token_id}
+        
+        self.pixel_mean = torch.tensor(
+            image_processor.image_mean, device=self.device, dtype=self.florence_dtype
+        ).view(1, 3, 1, 1)
+        self.pixel_std = torch.tensor(
+            image_processor.image_std, device=self.device, dtype=self.florence_dtype
+        ).view(1, 3, 1, 1)
+    
+    def compile_florence(self, model_path: str):
+        """Compile Florence-2 encoder/decoder into TensorRT engines via Torch-TensorRT"""
+        try:
+            import torch_tensorrt
+        except ImportError:
+            print("⚠️  torch_tensorrt not installed, running Florence-2 in eager mode")
+            return
+        
+        trt_options = {
+            "enabled_precisions": {torch.float16},
+            "truncate_long_and_double": True
         }
         
-        if self.yolo:
-            # Run YOLO detection
-            detections = self.yolo(image_rgb, 
-                                 conf=self.config['configs']['confidence_threshold'],
-                                 iou=self.config['configs']['iou_threshold'])[0]
+        vision_tower = self.florence_model.vision_tower
+        language_model = self.florence_model.language_model.model
+        eager_encoder, eager_decoder = language_model.encoder, language_model.decoder
+        
+        try:
+            # Vision tower: every crop is resized to the processor size, so only the
+            # batch dimension varies and one AOT engine covers all requests
+            height, width = self.pixel_size
+            max_batch = self.config['configs'].get('caption_batch_size', 32)
+            
+            cache_dir = Path(self.config['configs'].get('cache_dir', 'cache')) / 'florence'
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            engine_path = cache_dir / (
+                f"vision_trt_{self.florence_fingerprint(model_path)}_{self.yolo_cache_key()}"
+                f"_{height}x{width}_b{max_batch}.ep"
+            )
+            
+            if engine_path.exists():
+                vision_engine = torch.export.load(str(engine_path)).module()
+            else:
+                print("Compiling Florence-2 vision tower with TensorRT, this can take a few minutes...")
+                vision_engine = torch_tensorrt.compile(
+                    VisionFeatures(vision_tower),
+                    ir="dynamo",
+                    inputs=[torch_tensorrt.Input(
+                        min_shape=(1, 3, height, width),
+                        opt_shape=(min(8, max_batch), 3, height, width),
+                        max_shape=(max_batch, 3, height, width),
+                        dtype=torch.float16
+                    )],
+                    **trt_options
+                )
+                torch_tensorrt.save(vision_engine, str(engine_path))
+            
+            # Florence-2 calls forward_features_unpool rather than forward on the tower. Bind a
+            # plain function in the instance __dict__: assigning the Module itself would only
+            # register a submodule, and the class method would still shadow it on lookup
+            def forward_features_unpool(pixel_values):
+                self.vision_engine_calls += 1
+                return vision_engine(pixel_values)
+            
+            self.vision_engine_calls = 0
+            vision_tower.__dict__['forward_features_unpool'] = forward_features_unpool
             
-            # Process detections
-            for i, box in enumerate(detections.boxes):
-                if box.conf[0] < self.config['configs']['confidence_threshold']:
+            # Text encoder/decoder see variable sequence and KV-cache lengths, so they
+            # are JIT-compiled with dynamic shapes instead of exported ahead of time
+            language_model.encoder = torch.compile(
+                language_model.encoder, backend="tensorrt", dynamic=True, options=trt_options
+            )
+            language_model.decoder = torch.compile(
+                language_model.decoder, backend="tensorrt", dynamic=True, options=trt_options
+            )
+            
+            # torch.compile is lazy: trace the encoder/decoder now so a backend failure
+            # falls back here instead of failing every caption request
+            self.run_florence(torch.zeros(1, 3, height, width, dtype=self.florence_dtype, device=self.device))
+            print("✅ Florence-2 compiled with TensorRT")
+        except Exception as e:
+            vision_tower.__dict__.pop('forward_features_unpool', None)
+            self.__dict__.pop('vision_engine_calls', None)
+            language_model.encoder, language_model.decoder = eager_encoder, eager_decoder
+            print(f"⚠️  Florence-2 TensorRT compilation failed, running in eager mode: {e}")
+    
+    def init_memory_pool(self):
+        """Create and pre-touch a CUDA memory pool reused across requests"""
+        self.mem_pool = None
+        if self.device != 'cuda':
+            return
+        
+        torch.cuda.set_per_process_memory_fraction(self.config['configs'].get('memory_fraction', 0.8))
+        
+        if not hasattr(torch.cuda, 'MemPool'):
+            print("⚠️  torch.cuda.MemPool unavailable, using the default caching allocator")
+            return
+        
+        self.mem_pool = torch.cuda.MemPool()
+        
+        # Allocate peak-sized buffers once so later requests recycle the same blocks
+        with self.memory_pool_context():
+            input_size = self.config['configs']['input_size']
+            buffers = [torch.empty(1, 3, input_size, input_size, dtype=torch.float16, device='cuda')]
+            if self.florence_model:
+                max_batch = self.config['configs'].get('caption_batch_size', 32)
+                buffers.append(torch.empty(
+                    max_batch, 3, *self.pixel_size, dtype=self.florence_dtype, device='cuda'
+                ))
+            del buffers
+            
+        print("✅ CUDA memory pool ready")
+        
+    def memory_pool_context(self):
+        """Route CUDA allocations into the request memory pool when one exists"""
+        if self.mem_pool is None:
+            return contextlib.nullcontext()
+        return torch.cuda.use_mem_pool(self.mem_pool)
+        
+    def warmup(self):
+        """Run synthetic requests so compilation, autotuning and memory pools are hot before serving"""
+        print("Warming up models...")
+        for height, width in [(600, 800), (2160, 3840)]:
+            image = np.full((height, width, 3), 255, dtype=np.uint8)
+            cv2.rectangle(image, (100, 100), (300, 150), (80, 175, 76), -1)
+            self.detect_elements_from_ndarray(image)
+            
+            # A blank screen may yield no interactable boxes, so caption one directly
+            if self.florence_model:
+                with self.memory_pool_context(), torch.inference_mode():
+                    self.generate_captions(image, [[100, 100, 300, 150]])
+        
+        if self.device == 'cuda':
+            torch.cuda.synchronize()
+        
+        if self.florence_model and hasattr(self, 'vision_engine_calls'):
+            if self.vision_engine_calls:
+                print(f"✅ Florence-2 TensorRT vision engine used ({self.vision_engine_calls} calls)")
+            else:
+                print("⚠️  Florence-2 TensorRT vision engine was not called during warm-up")
+        print("✅ Warm-up complete")
+    
+    def result_cache_key(self, image_bytes: bytes, kind: str, opts: Dict[str, Any] = None) -> str:
+        """Key a result by the raw image bytes plus the request kind and options"""
+        digest = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+        return f"{kind}:{json.dumps(opts or {}, sort_keys=True)}:{digest}"
+    
+    def get_cached_result(self, key: str) -> Dict[str, Any]:
+        """Return a cached result and mark it most recently used"""
+        with self.result_cache_lock:
+            result = self.result_cache.get(key)
+            if result is None:
+                return None
+            # The annotated image may have been pruned from the output dir since
+            if 'visualization' in result and not os.path.exists(result['visualization']):
+                del self.result_cache[key]
+                return None
+            self.result_cache.move_to_end(key)
+            return result
+    
+    def cache_result(self, key: str, result: Dict[str, Any]):
+        """Store a result, evicting the least recently used entry when full"""
+        if self.result_cache_size <= 0:
+            return
+        with self.result_cache_lock:
+            self.result_cache[key] = result
+            self.result_cache.move_to_end(key)
+            while len(self.result_cache) > self.result_cache_size:
+                self.result_cache.popitem(last=False)
+    
+    def detect_elements(self, image_path: str) -> Dict[str, Any]:
+        """Detect UI elements in the image"""
+        return self.detect_elements_from_ndarray(cv2.imread(image_path))
+    
+    def detect_elements_from_ndarray(self, image_bgr: np.ndarray) -> Dict[str, Any]:
+        """Detect UI elements in an already-decoded BGR image"""
+        return self.detect_elements_batch([image_bgr])[0]
+    
+    def detect_elements_batch(self, images_bgr: List[np.ndarray]) -> List[Dict[str, Any]]:
+        """Detect UI elements in several BGR images with one YOLO call and shared caption batches"""
+        # inference_mode covers the whole request: no autograd graph or version-counter bookkeeping
+        with self.memory_pool_context(), torch.inference_mode():
+            batch_results = []
+            batch_elements = []
+            
+            if self.yolo:
+                # Run YOLO detection
+                batch_detections = self.run_yolo_batch(images_bgr)
+            else:
+                batch_detections = [None] * len(images_bgr)
+            
+            # Pass 1: build element metadata
+            for image_bgr, detections in zip(images_bgr, batch_detections):
+                elements = []
+                if detections is None:
+                    batch_elements.append(elements)
                     continue
                 
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                conf = box.conf[0].item()
-                cls = int(box.cls[0].item())
+                # Read all boxes in one device-to-host transfer instead of per-box syncs
+                xyxy = detections.boxes.xyxy.cpu().numpy()
+                confs = detections.boxes.conf.cpu().numpy()
+                classes = detections.boxes.cls.cpu().numpy().astype(int)
                 
-                # Classify element type based on YOLO class or heuristics
-                element_type = self.classify_element(image_rgb, (x1, y1, x2, y2), cls)
+                # Keep original box indices so element ids match the YOLO output order
+                keep = np.flatnonzero(confs >= self.config['configs']['confidence_threshold'])
                 
-                element = {
-                    'id': f'element_{i}',
-                    'type': element_type,
-                    'bbox': [int(x1), int(y1), int(x2), int(y2)],
-                    'confidence': float(conf),
-                    'center': [int((x1+x2)/2), int((y1+y2)/2)],
-                    'area': int((x2-x1) * (y2-y1)),
-                    'interactable': element_type in ['button', 'icon', 'input', 'link']
-                }
+                # Classify element types based on YOLO class or heuristics, all boxes at once
+                edge_integral = self.edge_integral(image_bgr)
+                element_types = self.classify_elements(edge_integral, xyxy[keep], classes[keep])
                 
-                # Generate caption if Florence is available
-                if self.florence_model and element['interactable']:
-                    element['label'] = self.generate_caption(image_rgb, element['bbox'])
-                else:
-                    element['label'] = f"{element_type}_{i}"
+                for i, element_type in zip(keep, element_types):
+                    x1, y1, x2, y2 = xyxy[i]
+                    conf = confs[i]
+                    
+                    element = {
+                        'id': f'element_{i}',
+                        'type': element_type,
+                        'bbox': [int(x1), int(y1), int(x2), int(y2)],
+                        'confidence': float(conf),
+                        'center': [int((x1+x2)/2), int((y1+y2)/2)],
+                        'area': int((x2-x1) * (y2-y1)),
+                        'interactable': element_type in ['button', 'icon', 'input', 'link'],
+                        'label': f"{element_type}_{i}"
+                    }
+                    elements.append(element)
+                batch_elements.append(elements)
+            
+            # Pass 2: caption interactable elements of every image in shared Florence batches
+            if self.florence_model:
+                to_caption = [
+                    (image_bgr, element)
+                    for image_bgr, elements in zip(images_bgr, batch_elements)
+                    for element in elements if element['interactable']
+                ]
+                captions = self.caption_regions([(image_bgr, e['bbox']) for image_bgr, e in to_caption])
+                for (_, element), caption in zip(to_caption, captions):
+                    element['label'] = caption
+            
+            for image_bgr, elements in zip(images_bgr, batch_elements):
+                results = {
+                    'icons': [],
+                    'buttons': [],
+                    'text': [],
+                    'interactable': [],
+                    'all_elements': []
+                }
                 
-                # Categorize element
-                results['all_elements'].append(element)
+                # Categorize elements
+                for element in elements:
+                    element_type = element['type']
+                    results['all_elements'].append(element)
+                    
+                    if element_type == 'icon':
+                        results['icons'].append(element)
+                    elif element_type == 'button':
+                        results['buttons'].append(element)
+                    elif element_type == 'text':
+                        results['text'].append(element)
+                    
+                    if element['interactable']:
+                        results['interactable'].append(element)
                 
-                if element_type == 'icon':
-                    results['icons'].append(element)
-                elif element_type == 'button':
-                    results['buttons'].append(element)
-                elif element_type == 'text':
-                    results['text'].append(element)
+                # If no YOLO, use basic detection
+                if not results['all_elements']:
+                    results = self.basic_detection(image_bgr)
                 
-                if element['interactable']:
-                    results['interactable'].append(element)
-        
-        # If no YOLO, use basic detection
-        if not results['all_elements']:
-            results = self.basic_detection(image_rgb)
-        
-        return results
+                batch_results.append(results)
+            
+            return batch_results
     
-    def classify_element(self, image: np.ndarray, bbox: Tuple, cls: int) -> str:
+    def edge_integral(self, image: np.ndarray) -> np.ndarray:
+        """Canny the whole image once and return its integral image for O(1) ROI edge sums"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        edges = cv2.Canny(gray, 50, 150)
+        # float64 sums: a 4K frame of 255-valued edges overflows int32
+        return cv2.integral(edges, sdepth=cv2.CV_64F)
+    
+    def classify_element(self, edge_integral: np.ndarray, bbox: Tuple, cls: int) -> str:
         """Classify UI element type based on visual features"""
-        x1, y1, x2, y2 = map(int, bbox)
-        roi = image[y1:y2, x1:x2]
+        return self.classify_elements(edge_integral, np.array([bbox]), np.array([cls]))[0]
+    
+    def classify_elements(self, edge_integral: np.ndarray, boxes: np.ndarray, classes: np.ndarray) -> List[str]:
+        """Classify many UI elements at once from their xyxy boxes and the edge integral image"""
+        if len(boxes) == 0:
+            return []
         
-        if roi.size == 0:
-            return 'unknown'
+        x1, y1, x2, y2 = boxes.astype(int).T
+        width, height = x2 - x1, y2 - y1
         
         # Calculate aspect ratio
-        aspect_ratio = (x2 - x1) / (y2 - y1) if (y2 - y1) > 0 else 1
+        aspect_ratio = np.divide(width, height, out=np.ones(len(boxes)), where=height > 0)
         
         # Calculate area
-        area = (x2 - x1) * (y2 - y1)
+        area = width * height
+        
+        # Edge density over the ROI clipped to the image, from four integral lookups
+        max_y, max_x = edge_integral.shape[0] - 1, edge_integral.shape[1] - 1
+        rx1, rx2 = np.clip(x1, 0, max_x), np.clip(x2, 0, max_x)
+        ry1, ry2 = np.clip(y1, 0, max_y), np.clip(y2, 0, max_y)
+        empty = (rx2 <= rx1) | (ry2 <= ry1)
+        roi_area = (rx2 - rx1) * (ry2 - ry1)
+        edge_sum = (edge_integral[ry2, rx2] - edge_integral[ry1, rx2]
+                    - edge_integral[ry2, rx1] + edge_integral[ry1, rx1])
+        edge_density = np.divide(edge_sum, roi_area, out=np.zeros(len(boxes)), where=~empty)
         
         # Simple heuristics for classification
-        if area < 2500:  # Small elements
-            return 'icon'
-        elif aspect_ratio > 2.5:  # Wide elements
-            return 'button'
-        elif aspect_ratio < 0.5:  # Tall elements
-            return 'sidebar'
-        else:
-            # Check for text-like patterns
-            gray_roi = cv2.cvtColor(roi, cv2.COLOR_RGB2GRAY)
-            edges = cv2.Canny(gray_roi, 50, 150)
-            edge_density = np.sum(edges) / (edges.shape[0] * edges.shape[1])
-            
-            if edge_density > 30:
-                return 'text'
-            else:
-                return 'button'
+        element_types = np.select(
+            [
+                empty,
+                area < 2500,           # Small elements
+                aspect_ratio > 2.5,    # Wide elements
+                aspect_ratio < 0.5,    # Tall elements
+                edge_density > 30      # Text-like patterns
+            ],
+            ['unknown', 'icon', 'button', 'sidebar', 'text'],
+            default='button'
+        )
+        return element_types.tolist()
     
     def generate_caption(self, image: np.ndarray, bbox: List[int]) -> str:
-        """Generate caption for UI element using Florence-2"""
+        """Generate caption for a single UI element of a BGR image using Florence-2"""
+        return self.generate_captions(image, [bbox])[0]
+    
+    def generate_captions(self, image: np.ndarray, bboxes: List[List[int]]) -> List[str]:
+        """Generate captions for many UI elements of one BGR image"""
+        return self.caption_regions([(image, bbox) for bbox in bboxes])
+    
+    def run_florence(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Run the caption task on a batch of normalized crops and return the generated token ids"""
+        input_ids = self.caption_input_ids.expand(len(pixel_values), -1)
+        
+        # Generate captions, keeping ops that default to fp32 in fp16 on GPU
+        autocast = torch.autocast(
+            device_type=self.device, dtype=self.florence_dtype, enabled=self.device == 'cuda'
+        )
+        with torch.inference_mode(), autocast:
+            return self.florence_model.generate(
+                input_ids=input_ids,
+                pixel_values=pixel_values,
+                max_new_tokens=self.config['configs'].get('caption_max_tokens', 10),
+                do_sample=False,
+                num_beams=1,
+                use_cache=True,
+                **self.stop_ids
+            )
+    
+    def caption_regions(self, regions: List[Tuple[np.ndarray, List[int]]]) -> List[str]:
+        """Caption (BGR image, bbox) regions, possibly from different images, in batched Florence-2 calls"""
         if not self.florence_model:
-            return "element"
+            return ["element"] * len(regions)
         
-        try:
-            x1, y1, x2, y2 = bbox
-            # Crop the element
-            element_crop = image[y1:y2, x1:x2]
-            
-            # Convert to PIL Image
-            pil_image = Image.fromarray(element_crop)
-            
-            # Prepare prompt for Florence
-            prompt = "<CAPTION>"
-            
-            inputs = self.processor(text=prompt, images=pil_image, return_tensors="pt").to(self.device)
-            
-            # Generate caption
-            with torch.no_grad():
-                generated_ids = self.florence_model.generate(
-                    **inputs,
-                    max_new_tokens=20,
-                    do_sample=False
-                )
-            
-            generated_text = self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        prompt = "<CAPTION>"
+        batch_size = self.config['configs'].get('caption_batch_size', 32)
+        captions = []
+        
+        # Upload each distinct image once; channel swap, crops, resizes and normalization happen on device
+        image_tensors = {}
+        for image, _ in regions:
+            if id(image) not in image_tensors:
+                image_tensor = torch.from_numpy(image).to(self.device).permute(2, 0, 1)[[2, 1, 0]]
+                image_tensors[id(image)] = image_tensor.to(self.florence_dtype) / 255.0
+        
+        for start in range(0, len(regions), batch_size):
+            batch = regions[start:start + batch_size]
+            try:
+                # Crop the elements
+                crops = []
+                for image, (x1, y1, x2, y2) in batch:
+                    height, width = image.shape[:2]
+                    x1, y1 = min(max(x1, 0), width - 1), min(max(y1, 0), height - 1)
+                    x2, y2 = max(min(x2, width), x1 + 1), max(min(y2, height), y1 + 1)
+                    crops.append(F.interpolate(
+                        image_tensors[id(image)][:, y1:y2, x1:x2].unsqueeze(0),
+                        size=self.pixel_size,
+                        mode='bilinear',
+                        align_corners=False
+                    ))
+                
+                pixel_values = (torch.cat(crops) - self.pixel_mean) / self.pixel_std
+                
+                generated_ids = self.run_florence(pixel_values)
+                generated_texts = self.processor.batch_decode(generated_ids, skip_special_tokens=True)
+                
+                # Extract captions from responses
+                for generated_text in generated_texts:
+                    caption = generated_text.replace(prompt, "").strip()
+                    captions.append(caption if caption else "UI element")
             
-            # Extract caption from response
-            caption = generated_text.replace(prompt, "").strip()
-            return caption if caption else "UI element"
+            except Exception as e:
+                print(f"Caption generation error: {e}")
+                captions.extend(["element"] * len(batch))
         
-        except Exception as e:
-            print(f"Caption generation error: {e}")
-            return "element"
+        return captions
     
     def basic_detection(self, image: np.ndarray) -> Dict[str, Any]:
         """Basic UI detection using traditional CV when models are not available"""
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         edges = cv2.Canny(gray, 50, 150)
         
         # Find contours
@@ -228,23 +862,14 @@ class LocalOmniParser:
             'all_elements': []
         }
         
-        for i, contour in enumerate(contours[:50]):  # Limit to 50 elements
-            x, y, w, h = cv2.boundingRect(contour)
-            
-            # Filter small contours
-            if w < 20 or h < 20:
-                continue
-            
-            aspect_ratio = w / h if h > 0 else 1
-            area = w * h
-            
-            # Classify based on heuristics
-            if area < 2500:
-                element_type = 'icon'
-            elif aspect_ratio > 2.5:
-                element_type = 'button'
-            else:
-                element_type = 'text'
+        # Limit to 50 elements
+        boxes = np.array([cv2.boundingRect(c) for c in contours[:50]], dtype=np.int32).reshape(-1, 4)
+        keep, types, areas = classify_contour_boxes(boxes)
+        
+        for i in np.flatnonzero(keep):
+            x, y, w, h = (int(v) for v in boxes[i])
+            area = int(areas[i])
+            element_type = CONTOUR_TYPES[types[i]]
             
             element = {
                 'id': f'element_{i}',
@@ -271,52 +896,51 @@ class LocalOmniParser:
         
         return results
     
-    def visualize_detections(self, image_path: str, detections: Dict[str, Any], output_path: str = None):
-        """Visualize detected elements on the image"""
-        image = Image.open(image_path)
-        draw = ImageDraw.Draw(image)
-        
-        # Try to load a font
-        try:
-            font = ImageFont.truetype("/System/Library/Fonts/Helvetica.ttc", 16)
-        except:
-            font = ImageFont.load_default()
-        
-        colors = {
-            'icon': '#FF6B6B',
-            'button': '#4ECDC4',
-            'text': '#45B7D1',
-            'unknown': '#95A5A6'
-        }
+    def visualize_detections(self, image_bgr: np.ndarray, detections: Dict[str, Any], output_path: str = None):
+        """Visualize detected elements on a copy of the image"""
+        image = image_bgr.copy()
+        height, width = image.shape[:2]
+        font = cv2.FONT_HERSHEY_SIMPLEX
         
         for element in detections['all_elements']:
-            bbox = element['bbox']
-            element_type = element['type']
-            color = colors.get(element_type, '#95A5A6')
+            x1, y1, x2, y2 = element['bbox']
+            color = VISUALIZATION_COLORS.get(element['type'], VISUALIZATION_COLORS['unknown'])
             
             # Draw bounding box
-            draw.rectangle(bbox, outline=color, width=2)
+            cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
             
-            # Draw label with background
+            # Draw label with a semi-transparent background
             label = f"{element['id']}: {element['label'][:20]}"
-            text_bbox = draw.textbbox((bbox[0], bbox[1]-20), label, font=font)
-            draw.rectangle(text_bbox, fill=color)
-            draw.text((bbox[0], bbox[1]-20), label, fill='white', font=font)
+            (text_width, text_height), _ = cv2.getTextSize(label, font, 0.5, 1)
+            label_y1 = max(y1 - text_height - 10, 0)
+            label_y2 = label_y1 + text_height + 8
+            label_x2 = min(x1 + text_width + 4, width)
+            background = image[label_y1:label_y2, x1:label_x2]
+            if background.size:
+                background[:] = cv2.addWeighted(background, 0.3, np.full_like(background, color), 0.7, 0)
+            cv2.putText(image, label, (x1 + 2, label_y2 - 5), font, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
             
             # Draw confidence
             conf_text = f"{element['confidence']:.2f}"
-            draw.text((bbox[0], bbox[3]+5), conf_text, fill=color, font=font)
+            conf_y = min(y2 + 18, height - 2)
+            cv2.putText(image, conf_text, (x1, conf_y), font, 0.5, color, 1, cv2.LINE_AA)
         
         if output_path:
-            image.save(output_path)
+            cv2.imwrite(output_path, image)
         
         return image
     
     def parse_screen(self, image_path: str, visualize: bool = False) -> Dict[str, Any]:
         """Complete screen parsing pipeline"""
-        # Detect elements
-        detections = self.detect_elements(image_path)
+        image = cv2.imread(image_path)
         
+        # Detect elements
+        detections = self.detect_elements_from_ndarray(image)
+        return self.parse_detections(image_path, image, detections, visualize=visualize)
+    
+    def parse_detections(self, image_path: str, image_bgr: np.ndarray, detections: Dict[str, Any],
+                         visualize: bool = False) -> Dict[str, Any]:
+        """Build the parse result (summary, layout, visualization) from detections"""
         # Calculate summary statistics
         summary = {
             'total_elements': len(detections['all_elements']),
@@ -338,50 +962,59 @@ class LocalOmniParser:
         
         # Generate visualization if requested
         if visualize:
-            viz_path = image_path.replace('.', '_annotated.')
-            self.visualize_detections(image_path, detections, viz_path)
-            result['visualization'] = viz_path
+            result['visualization'] = self.save_visualization(image_path, image_bgr, detections)
         
         return result
     
+    def save_visualization(self, image_path: str, image_bgr: np.ndarray, detections: Dict[str, Any]) -> str:
+        """Write the annotated image to the output dir, keeping only the newest max_visualizations files"""
+        output_dir = Path(self.config['configs'].get('output_dir', 'outputs'))
+        output_dir.mkdir(parents=True, exist_ok=True)
+        path = Path(image_path)
+        viz_path = output_dir / f"{path.stem}_annotated{path.suffix or '.png'}"
+        self.visualize_detections(image_bgr, detections, str(viz_path))
+        
+        # Every upload gets a unique name, so prune the oldest instead of letting the dir grow
+        max_visualizations = self.config['configs'].get('max_visualizations', 100)
+        annotated = sorted(output_dir.glob('*_annotated.*'), key=lambda p: p.stat().st_mtime_ns)
+        for stale in annotated[:max(0, len(annotated) - max_visualizations)]:
+            stale.unlink(missing_ok=True)
+        
+        return str(viz_path)
+    
     def analyze_layout(self, elements: List[Dict]) -> Dict[str, Any]:
         """Analyze the layout of detected elements"""
         if not elements:
             return {'type': 'empty', 'regions': {}}
         
+        centers = np.array([e['center'] for e in elements])
+        bboxes = np.array([e['bbox'] for e in elements])
+        
         # Get image dimensions from largest bbox
-        max_x = max(e['bbox'][2] for e in elements)
-        max_y = max(e['bbox'][3] for e in elements)
+        max_x = bboxes[:, 2].max()
+        max_y = bboxes[:, 3].max()
+        cx, cy = centers[:, 0], centers[:, 1]
+        
+        # Vertical and horizontal region masks
+        top = cy < max_y / 3
+        bottom = cy >= 2 * max_y / 3
+        left = cx < max_x / 3
+        right = cx >= 2 * max_x / 3
+        masks = {
+            'top': top,
+            'middle': ~(top | bottom),
+            'bottom': bottom,
+            'left': left,
+            'center': ~(left | right),
+            'right': right
+        }
         
         # Divide into regions
         regions = {
-            'top': [],
-            'middle': [],
-            'bottom': [],
-            'left': [],
-            'center': [],
-            'right': []
+            name: [elements[i]['id'] for i in np.where(mask)[0]]
+            for name, mask in masks.items()
         }
         
-        for element in elements:
-            cx, cy = element['center']
-            
-            # Vertical regions
-            if cy < max_y / 3:
-                regions['top'].append(element['id'])
-            elif cy < 2 * max_y / 3:
-                regions['middle'].append(element['id'])
-            else:
-                regions['bottom'].append(element['id'])
-            
-            # Horizontal regions
-            if cx < max_x / 3:
-                regions['left'].append(element['id'])
-            elif cx < 2 * max_x / 3:
-                regions['center'].append(element['id'])
-            else:
-                regions['right'].append(element['id'])
-        
         # Determine layout type
         layout_type = 'balanced'
         if len(regions['top']) > len(regions['middle']) + len(regions['bottom']):
@@ -410,12 +1043,204 @@ class LocalOmniParser:
         else:
             return 'dense'
 
+class InferenceQueue:
+    """Queue-based dispatcher: HTTP handlers enqueue jobs, GPU workers drain and batch them"""
+    
+    def __init__(self, parser: LocalOmniParser, num_workers: int = 1, max_batch: int = 8,
+                 batch_timeout: float = 0.005, max_results: int = 256):
+        self.parser = parser
+        self.max_batch = max_batch
+        self.batch_timeout = batch_timeout
+        self.max_results = max_results
+        
+        self.pending = queue.Queue()
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        
+        # All workers share one LocalOmniParser, and the ultralytics predictor inside it is
+        # not thread-safe, so only a single worker is supported until each gets its own models
+        if num_workers != 1:
+            print(f"⚠️  queue_workers={num_workers} is not supported with a shared model, using 1")
+            num_workers = 1
+        
+        # Each worker is one in-flight batch on the GPU, like an OpenVINO infer request
+        self.workers = [
+            threading.Thread(target=self.worker_loop, name=f"inference-worker-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+    
+    def submit(self, kind: str, image_bgr: np.ndarray, image_path: str, opts: Dict[str, Any] = None,
+               cache_key: str = None) -> str:
+        """Enqueue a 'parse' or 'detect' job for a decoded image and return its id"""
+        job = self.register(kind, image_bgr, image_path, opts, cache_key)
+        self.pending.put(job)
+        return job['id']
+    
+    def add_finished(self, kind: str, result: Dict[str, Any]) -> str:
+        """Record an already-computed result (e.g. a cache hit) as a finished job and return its id"""
+        job = self.register(kind, None, None)
+        job['result'] = result
+        job['status'] = 'done'
+        job['done'].set()
+        return job['id']
+    
+    def register(self, kind: str, image_bgr: np.ndarray, image_path: str, opts: Dict[str, Any] = None,
+                 cache_key: str = None) -> Dict[str, Any]:
+        """Create a queued job and track it under a fresh id"""
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'image': image_bgr,
+            'image_path': image_path,
+            'opts': opts or {},
+            'cache_key': cache_key,
+            'status': 'queued',
+            'result': None,
+            'error': None,
+            'done': threading.Event()
+        }
+        
+        with self.lock:
+            self.jobs[job['id']] = job
+            self.evict_finished()
+        return job
+    
+    def get(self, job_id: str) -> Dict[str, Any]:
+        """Look up a job by id"""
+        with self.lock:
+            return self.jobs.get(job_id)
+    
+    def pop(self, job_id: str) -> Dict[str, Any]:
+        """Remove a job once its result has been delivered"""
+        with self.lock:
+            return self.jobs.pop(job_id, None)
+    
+    def wait(self, job_id: str, timeout: float = None) -> Dict[str, Any]:
+        """Block until a job finishes, then remove and return it"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job['done'].wait(timeout)
+        if not job['done'].is_set():
+            return job
+        # The job may already have been evicted; the local reference still holds the result
+        return self.pop(job_id) or job
+    
+    def evict_finished(self):
+        """Drop the oldest finished jobs whose results were never collected"""
+        finished = [job_id for job_id, job in self.jobs.items() if job['done'].is_set()]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_results)]:
+            del self.jobs[job_id]
+    
+    def next_batch(self) -> List[Dict[str, Any]]:
+        """Block for one job, then drain up to max_batch more within batch_timeout"""
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.batch_timeout
+        
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        return batch
+    
+    def worker_loop(self):
+        """Run batches of queued jobs forever"""
+        while True:
+            batch = self.next_batch()
+            for job in batch:
+                job['status'] = 'running'
+            
+            try:
+                batch_detections = self.parser.detect_elements_batch([job['image'] for job in batch])
+            except Exception:
+                # Rerun one at a time so a bad upload only fails its own job
+                batch_detections = []
+                for job in batch:
+                    try:
+                        batch_detections.append(self.parser.detect_elements_batch([job['image']])[0])
+                    except Exception as e:
+                        batch_detections.append(e)
+            
+            for job, detections in zip(batch, batch_detections):
+                try:
+                    if isinstance(detections, Exception):
+                        raise detections
+                    
+                    if job['kind'] == 'parse':
+                        job['result'] = self.parser.parse_detections(
+                            job['image_path'], job['image'], detections,
+                            visualize=job['opts'].get('visualize', False)
+                        )
+                    else:
+                        job['result'] = detections
+                    job['status'] = 'done'
+                    
+                    if job['cache_key']:
+                        self.parser.cache_result(job['cache_key'], job['result'])
+                except Exception as e:
+                    job['error'] = str(e)
+                    job['status'] = 'error'
+                finally:
+                    # Release the decoded image, only the result is kept around
+                    job['image'] = None
+                    job['done'].set()
+
 # Flask API Server
 app = Flask(__name__)
 CORS(app)
 
 # Initialize parser
 parser = None
+inference_queue = None
+
+def job_response(job: Dict[str, Any]):
+    """Turn a job into an HTTP response: 202 while pending, the result once finished"""
+    if job['status'] in ('queued', 'running'):
+        return jsonify({'job_id': job['id'], 'status': job['status']}), 202
+    if job['status'] == 'error':
+        return jsonify({'job_id': job['id'], 'error': job['error']}), 500
+    return jsonify(job['result'])
+
+def enqueue_upload(kind: str, opts: Dict[str, Any] = None):
+    """Decode the uploaded image in memory and queue it; wait for the result unless async=true"""
+    image = request.files['image']
+    image_bytes = image.read()
+    is_async = request.form.get('async', 'false').lower() == 'true'
+    
+    # Identical screenshots skip inference entirely; ?nocache=1 or Cache-Control: no-store bypasses
+    use_cache = (request.args.get('nocache', '0').lower() not in ('1', 'true')
+                 and 'no-store' not in request.headers.get('Cache-Control', ''))
+    cache_key = parser.result_cache_key(image_bytes, kind, opts) if use_cache else None
+    if cache_key:
+        cached = parser.get_cached_result(cache_key)
+        if cached is not None:
+            # Async clients expect a job id either way; the job is already finished
+            if is_async:
+                job_id = inference_queue.add_finished(kind, cached)
+                return jsonify({'job_id': job_id, 'status': 'done'}), 202
+            return jsonify(cached)
+    
+    buffer = np.frombuffer(image_bytes, np.uint8)
+    image_bgr = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if image_bgr is None:
+        return jsonify({'error': 'Could not decode image'}), 400
+    
+    # Never written to disk; names the upload in results and the visualization output
+    image_path = f"temp_{uuid.uuid4().hex}_{os.path.basename(image.filename or 'upload.png')}"
+    
+    job_id = inference_queue.submit(kind, image_bgr, image_path, opts, cache_key=cache_key)
+    
+    if is_async:
+        return jsonify({'job_id': job_id, 'status': 'queued'}), 202
+    
+    return job_response(inference_queue.wait(job_id))
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -427,18 +1252,9 @@ def parse_image():
         if 'image' not in request.files:
             return jsonify({'error': 'No image provided'}), 400
         
-        image = request.files['image']
-        image_path = f"temp_{image.filename}"
-        image.save(image_path)
-        
         # Parse the image
         visualize = request.form.get('visualize', 'false').lower() == 'true'
-        result = parser.parse_screen(image_path, visualize=visualize)
-        
-        # Clean up
-        os.remove(image_path)
-        
-        return jsonify(result)
+        return enqueue_upload('parse', {'visualize': visualize})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -449,34 +1265,62 @@ def detect_elements():
         if 'image' not in request.files:
             return jsonify({'error': 'No image provided'}), 400
         
-        image = request.files['image']
-        image_path = f"temp_{image.filename}"
-        image.save(image_path)
-        
         # Detect elements
-        detections = parser.detect_elements(image_path)
-        
-        # Clean up
-        os.remove(image_path)
-        
-        return jsonify(detections)
+        return enqueue_upload('detect')
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/result/<job_id>', methods=['GET'])
+def get_result(job_id):
+    job = inference_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+    
+    if job['done'].is_set():
+        inference_queue.pop(job_id)
+    return job_response(job)
+
+def create_app(model_config_path: str = "models/model_config.json") -> Flask:
+    """Load models, warm them up and start the inference workers, then return the app
+    
+    Serve with a single process so there is one CUDA context and allocator, and
+    threads to overlap upload/decoding with GPU compute. On CUDA, OMP_NUM_THREADS=1
+    keeps PyTorch/OpenCV from oversubscribing the serving threads (leave it unset on
+    CPU, where Florence-2 and YOLO rely on the intra-op thread pool):
+        OMP_NUM_THREADS=1 gunicorn -w 1 --threads 8 -k gthread --timeout 300 -b 0.0.0.0:5001 \\
+            --pythonpath python 'omniparser_local:create_app()'
+    """
+    global parser, inference_queue
+    
+    # Initialize parser
+    parser = LocalOmniParser(model_config_path)
+    parser.warmup()
+    
+    # Start the batching inference workers
+    configs = parser.config['configs']
+    inference_queue = InferenceQueue(
+        parser,
+        num_workers=configs.get('queue_workers', 1),
+        max_batch=configs.get('queue_batch_size', 8),
+        batch_timeout=configs.get('queue_timeout_ms', 5) / 1000.0
+    )
+    
+    return app
+
 if __name__ == '__main__':
     print("\n" + "="*50)
     print("   OmniParser Local Server")
     print("="*50)
     
-    # Initialize parser
-    parser = LocalOmniParser()
+    create_app()
     
     print("\n🚀 Starting Flask server on port 5001...")
     print("📍 API Endpoints:")
     print("   GET  /health - Check server status")
     print("   POST /parse - Parse UI screenshot")
     print("   POST /detect - Detect UI elements")
+    print("   GET  /result/<job_id> - Fetch result of an async=true request")
     print("\n")
     
-    app.run(host='0.0.0.0', port=5001, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5001, debug=False, threaded=True)
\ No newline at end of file
@@ -5,6 +5,7 @@ Setup script to download and prepare OmniParser models for local execution
 
 import os
 import sys
+import shutil
 import torch
 from pathlib import Path
 from huggingface_hub import snapshot_download, hf_hub_download
@@ -47,17 +48,49 @@ def download_yolo_model():
         model.save('models/yolo/yolov8m.pt')
         return 'models/yolo/yolov8m.pt'
 
+# tmpfs copy of Florence-2 so multiple server processes share one set of pages
+FLORENCE_SHM_PATH = "/dev/shm/florence"
+
+def stage_to_shm(model_path, shm_path):
+    """Copy model files to shared memory (tmpfs) when available"""
+    shm_path = Path(shm_path)
+    if not shm_path.parent.is_dir():
+        print(f"⚠️  {shm_path.parent} not available, serving weights from disk")
+        return None
+    
+    # Copy next to the target and swap it in, so a full tmpfs never leaves a partial copy
+    staging_path = shm_path.with_name(f"{shm_path.name}.staging")
+    try:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        shutil.copytree(model_path, staging_path)
+        shutil.rmtree(shm_path, ignore_errors=True)
+        os.replace(staging_path, shm_path)
+        print(f"✓ Staged model in shared memory: {shm_path}")
+        return str(shm_path)
+    except Exception as e:
+        print(f"⚠️  Could not stage model in shared memory: {e}")
+        shutil.rmtree(staging_path, ignore_errors=True)
+        return None
+
 def download_florence_model():
     """Download Florence-2 model for caption generation"""
     print("\n📦 Downloading Florence-2 model for caption generation...")
     try:
-        # Download Florence-2 base model
+        # Download Florence-2 base model, preferring memory-mappable safetensors weights
         model_path = snapshot_download(
             repo_id="microsoft/Florence-2-base",
             local_dir="models/florence",
             local_dir_use_symlinks=False,
-            ignore_patterns=["*.md", "*.txt"]
+            allow_patterns=["*.safetensors", "*.json", "*.txt", "*.py"]
         )
+        if not any(Path(model_path).glob("*.safetensors")):
+            print("⚠️  No safetensors weights published, downloading PyTorch weights")
+            snapshot_download(
+                repo_id="microsoft/Florence-2-base",
+                local_dir="models/florence",
+                local_dir_use_symlinks=False,
+                allow_patterns=["*.bin"]
+            )
         print(f"✓ Florence-2 model downloaded to: {model_path}")
         return model_path
     except Exception as e:
@@ -107,7 +140,7 @@ def verify_cuda():
         print("⚠️  CUDA is not available, will use CPU (slower performance)")
         return False
 
-def create_model_info():
+def create_model_info(florence_shm_path=None):
     """Create a JSON file with model paths and configuration"""
     import json
     
@@ -119,10 +152,28 @@ def create_model_info():
             "confidence_threshold": 0.3,
             "iou_threshold": 0.45,
             "max_detections": 100,
-            "input_size": 640
+            "input_size": 640,
+            "precision": "fp16",
+            "int8_calibration_data": None,
+            "export_yolo": True,
+            "compile_florence": True,
+            "cuda_graph": True,
+            "caption_batch_size": 32,
+            "caption_max_tokens": 10,
+            "queue_workers": 1,
+            "queue_batch_size": 8,
+            "queue_timeout_ms": 5,
+            "result_cache_size": 256,
+            "cache_dir": "cache",
+            "output_dir": "outputs",
+            "max_visualizations": 100
         }
     }
     
+    # Only point the server at the shared-memory copy if staging succeeded
+    if florence_shm_path:
+        model_info["florence_shm_path"] = florence_shm_path
+    
     with open('models/model_config.json', 'w') as f:
         json.dump(model_info, f, indent=2)
     print("\n✓ Created model configuration file")
@@ -141,12 +192,13 @@ def main():
     # Download models
     yolo_path = download_yolo_model()
     florence_path = download_florence_model()
+    florence_shm_path = stage_to_shm(florence_path, FLORENCE_SHM_PATH) if florence_path else None
     
     # Download configs
     download_omniparser_configs()
     
     # Create configuration
-    create_model_info()
+    create_model_info(florence_shm_path)
     
     print("\n" + "="*50)
     print("✅ Setup completed successfully!")